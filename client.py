@@ -1,112 +1,353 @@
 import asyncio
-import base64
-import json
+import atexit
+import orjson
 import os
 import sys
+import threading
 import datetime
+import logging
 import secrets
+import struct
 from cryptography.hazmat.primitives.asymmetric import x25519, ed25519
-from cryptography.hazmat.primitives.kdf.hkdf import HKDF
-from cryptography.hazmat.primitives import hashes, serialization as ser
-from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives import serialization as ser
 from cryptography.exceptions import InvalidSignature
 import websockets
+from utils import b64, ub64, derive_shared_key, load_or_create_identity
+from framing import (
+    FRAME_CIPHERTEXT, FRAME_JSON, is_relay_frame, pack_relay, pack_ciphertext,
+    unpack_relay, unpack_ciphertext,
+)
+
+try:
+    import uvloop
+except ImportError:  # uvloop is unavailable on Windows
+    uvloop = None
+
+# AEAD backend: libsodium picks its SSSE3/AVX2 ChaCha20 code path at runtime
+# and is preferred; the pyca/OpenSSL fallback gets whatever assembly the system
+# OpenSSL ships. Either way encrypt+tag is a single native call per message.
+try:
+    from nacl.bindings import (
+        crypto_aead_chacha20poly1305_ietf_encrypt,
+        crypto_aead_chacha20poly1305_ietf_decrypt,
+    )
+
+    def _aead_new(key: bytes):
+        # libsodium is stateless: the key itself is the context
+        return key
+
+    def _aead_encrypt(aead, nonce: bytes, pt: bytes) -> bytes:
+        return crypto_aead_chacha20poly1305_ietf_encrypt(pt, None, nonce, aead)
+
+    def _aead_decrypt(aead, nonce: bytes, ct: bytes) -> bytes:
+        return crypto_aead_chacha20poly1305_ietf_decrypt(ct, None, nonce, aead)
+
+    AEAD_BACKEND = "libsodium"
+except ImportError:
+    from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+
+    def _aead_new(key: bytes):
+        return ChaCha20Poly1305(key)
+
+    def _aead_encrypt(aead, nonce: bytes, pt: bytes) -> bytes:
+        return aead.encrypt(nonce, pt, None)
+
+    def _aead_decrypt(aead, nonce: bytes, ct: bytes) -> bytes:
+        return aead.decrypt(nonce, ct, None)
+
+    AEAD_BACKEND = "openssl"
+
+# X25519 backend: libsodium's scalarmult (runtime-dispatched, AVX2 "sandy2x" on
+# capable CPUs) on raw 32-byte scalars/points, else pyca.
+try:
+    from nacl.bindings import crypto_scalarmult, crypto_scalarmult_base
+
+    def _x25519_public(priv_bytes: bytes) -> bytes:
+        return crypto_scalarmult_base(priv_bytes)
+
+    def fast_x25519_exchange(priv_bytes: bytes, pub_bytes: bytes) -> bytes:
+        return crypto_scalarmult(priv_bytes, pub_bytes)
+
+    X25519_BACKEND = "libsodium"
+except ImportError:
+    def _x25519_public(priv_bytes: bytes) -> bytes:
+        return x25519.X25519PrivateKey.from_private_bytes(priv_bytes).public_key().public_bytes(
+            encoding=ser.Encoding.Raw, format=ser.PublicFormat.Raw
+        )
+
+    def fast_x25519_exchange(priv_bytes: bytes, pub_bytes: bytes) -> bytes:
+        priv = x25519.X25519PrivateKey.from_private_bytes(priv_bytes)
+        return priv.exchange(x25519.X25519PublicKey.from_public_bytes(pub_bytes))
+
+    X25519_BACKEND = "openssl"
+
+# Ed25519 signing: libsodium straight on the raw seed||pub secret key, else pyca.
+try:
+    from nacl.bindings import crypto_sign, crypto_sign_BYTES
+
+    def _ed25519_signer(priv: ed25519.Ed25519PrivateKey):
+        sk = priv.private_bytes(
+            encoding=ser.Encoding.Raw, format=ser.PrivateFormat.Raw,
+            encryption_algorithm=ser.NoEncryption()
+        ) + priv.public_key().public_bytes(encoding=ser.Encoding.Raw, format=ser.PublicFormat.Raw)
+        return lambda msg: crypto_sign(msg, sk)[:crypto_sign_BYTES]
+except ImportError:
+    def _ed25519_signer(priv: ed25519.Ed25519PrivateKey):
+        return priv.sign
 
 
 IDENTITY_FILE = "identity_key.pem"
-LOG_KEY = ChaCha20Poly1305.generate_key()
+LOG_FILE = "messages.log"
+LOG_FLUSH_EVERY = 64         # flush the encrypted log after this many entries
+LOG_FLUSH_INTERVAL = 0.1     # ...or this many seconds after the oldest unflushed entry
+ID_PUB_CACHE_MAX = 1024      # parsed peer identity keys kept for reconnects
+KDF_BLAKE2 = "blake2"        # handshake capability: derive session keys with keyed BLAKE2b
+LOG_KEY = secrets.token_bytes(32)
+VERIFY_BATCH_SIZE = 8        # most signatures handed to one executor job
+
+# Status/trace output. Per-message traces (including received plaintext) are
+# DEBUG; the CLI below shows everything, the gateway routes this logger through
+# its own queue-backed handler at its LOG_LEVEL.
+log = logging.getLogger("chat")
 
 # ========== Utility Functions ==========
 
-def b64(x: bytes) -> str:
-    return base64.b64encode(x).decode()
+def generate_ephemeral():
+    """Return a fresh (private, public) raw X25519 key pair, clamped per RFC 7748."""
+    priv = bytearray(secrets.token_bytes(32))
+    priv[0] &= 248
+    priv[31] &= 127
+    priv[31] |= 64
+    priv = bytes(priv)
+    return priv, _x25519_public(priv)
+
+def verify_batch(items):
+    """
+    Verify a batch of (Ed25519PublicKey, sig, msg) triples.
+    Returns one entry per item: None if valid, otherwise the raised exception.
+    """
+    results = []
+    for pub, sig_b, msg_b in items:
+        try:
+            pub.verify(sig_b, msg_b)
+            results.append(None)
+        except Exception as e:
+            results.append(e)
+    return results
 
-def ub64(s: str) -> bytes:
-    return base64.b64decode(s.encode())
 
-def save_identity(priv: ed25519.Ed25519PrivateKey, path=IDENTITY_FILE):
-    pem = priv.private_bytes(
-        encoding=ser.Encoding.PEM,
-        format=ser.PrivateFormat.PKCS8,
-        encryption_algorithm=ser.NoEncryption()
-    )
-    with open(path, "wb") as f:
-        f.write(pem)
-
-def load_or_create_identity(path=IDENTITY_FILE):
-    if os.path.exists(path):
-        with open(path, "rb") as f:
-            pem = f.read()
-        priv = ser.load_pem_private_key(pem, password=None)
-        if not isinstance(priv, ed25519.Ed25519PrivateKey):
-            raise RuntimeError("Identity key is not Ed25519")
-        return priv
-    else:
-        priv = ed25519.Ed25519PrivateKey.generate()
-        save_identity(priv, path)
-        return priv
-
-def derive_shared_key(shared_secret: bytes, info=b"handshake v1", length=32):
-    hkdf = HKDF(
-        algorithm=hashes.SHA256(),
-        length=length,
-        salt=None,
-        info=info,
-    )
-    return hkdf.derive(shared_secret)
+# Handshake signatures from every ChatClient in the process (the gateway runs
+# one per browser user) share this queue. A lone signature goes straight to the
+# executor; ones that arrive while a job is running wait for it and then go
+# out together, so batches only form under load and nothing waits on a timer.
+_verify_pending = []   # [((pub, sig, msg), future), ...]
+_verify_busy = False
+
+
+def submit_verify(pub, sig_b, msg_b):
+    """Queue one signature; the returned future resolves to verify_batch's entry for it."""
+    fut = asyncio.get_running_loop().create_future()
+    _verify_pending.append(((pub, sig_b, msg_b), fut))
+    if not _verify_busy:
+        _run_verify_batch()
+    return fut
+
+
+def _run_verify_batch():
+    global _verify_busy
+    batch = _verify_pending[:VERIFY_BATCH_SIZE]
+    del _verify_pending[:VERIFY_BATCH_SIZE]
+    if not batch:
+        _verify_busy = False
+        return
+    _verify_busy = True
+    futures = [fut for _, fut in batch]
+
+    def on_done(job):
+        try:
+            results = job.result()
+        except Exception as e:
+            results = [e] * len(futures)
+        for fut, res in zip(futures, results):
+            if not fut.done():
+                fut.set_result(res)
+        _run_verify_batch()
+
+    job = asyncio.get_running_loop().run_in_executor(None, verify_batch, [item for item, _ in batch])
+    job.add_done_callback(on_done)
 
 
 # ========== Chat Client ==========
 
 class ChatClient:
-    def __init__(self, username, host="127.0.0.1", port=9000):
+    def __init__(self, username, host="127.0.0.1", port=9000, fast_kdf=True):
         self.username = username
         self.host = host
         self.port = port
-        self.identity_priv = load_or_create_identity()
+        self.fast_kdf = fast_kdf   # offer BLAKE2b key derivation to peers that support it
+        self.identity_priv = load_or_create_identity(IDENTITY_FILE)
         self.identity_pub = self.identity_priv.public_key()
+        self._sign = _ed25519_signer(self.identity_priv)
+        self._identity_pub_b64 = b64(self.identity_pub.public_bytes(
+            encoding=ser.Encoding.Raw, format=ser.PublicFormat.Raw
+        ))
         self.websocket = None
-        self.sessions = {}
+        self.sessions = {}          # peer -> (key, aead context)
+        self._pair_id_cache = {}    # peer -> HKDF info bytes
+        self._nonce_salt = {}       # peer -> 4-byte nonce prefix for our sending direction
+        self._nonce_ctr = {}        # peer -> next nonce counter
         self.my_eph_priv = None
         self.on_message = None
+        self._id_pub_cache = {}     # raw identity bytes -> Ed25519PublicKey
+        self._log_fp = open(LOG_FILE, "ab", buffering=64 * 1024)
+        self._log_q = asyncio.Queue()
+        self._log_task = None
+        atexit.register(self._close_log)
 
     async def connect(self):
         uri = f"ws://{self.host}:{self.port}"
-        self.websocket = await websockets.connect(uri)
-        await self.websocket.send(json.dumps({"type": "register", "username": self.username}))
-        print(f"[✅ CONNECTED] {self.username} registered to {self.host}:{self.port}")
+        # Frames are small JSON blobs sent as binary: skip permessage-deflate and
+        # the UTF-8 validation text frames would get.
+        self.websocket = await websockets.connect(uri, max_size=2**20, compression=None)
+        await self.websocket.send(orjson.dumps({"type": "register", "username": self.username}))
+        log.info(f"[✅ CONNECTED] {self.username} registered to {self.host}:{self.port}")
         asyncio.create_task(self._message_loop())
+        if self._log_task is None or self._log_task.done():
+            self._log_task = asyncio.create_task(self._log_writer())
+
+    def close(self):
+        """Stop the log writer and flush any queued entries to disk."""
+        if self._log_task is not None:
+            self._log_task.cancel()
+            self._log_task = None
+        atexit.unregister(self._close_log)
+        self._close_log()
+
+    async def _log_writer(self):
+        """Write queued log lines off the send path, flushing in batches."""
+        loop = asyncio.get_running_loop()
+        pending = 0
+        deadline = None  # flush by this loop time, counted from the oldest unflushed line
+        while True:
+            timeout = None if deadline is None else deadline - loop.time()
+            line = None
+            if timeout is None or timeout > 0:
+                try:
+                    line = await asyncio.wait_for(self._log_q.get(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if line is not None:
+                self._log_fp.write(line)
+                pending += 1
+                if deadline is None:
+                    deadline = loop.time() + LOG_FLUSH_INTERVAL
+            if pending >= LOG_FLUSH_EVERY or (deadline is not None and loop.time() >= deadline):
+                self._log_fp.flush()
+                pending = 0
+                deadline = None
+
+    def _close_log(self):
+        if self._log_fp.closed:
+            return
+        while not self._log_q.empty():
+            self._log_fp.write(self._log_q.get_nowait())
+        self._log_fp.close()
 
     async def ensure_connected(self):
         if self.websocket is None or self.websocket.closed:
-            print(f"[INFO] Reconnecting backend client for {self.username}...")
+            log.info(f"[INFO] Reconnecting backend client for {self.username}...")
             await self.connect()
 
     async def _message_loop(self):
         try:
             async for message in self.websocket:
+                if is_relay_frame(message):
+                    await self._handle_frame(message)
+                    continue
                 try:
-                    msg = json.loads(message)
+                    msg = orjson.loads(message)
                     if "from" in msg and "payload" in msg:
                         await self._handle_incoming(msg["from"], msg["payload"])
                     else:
-                        print("SERVER:", msg)
-                except json.JSONDecodeError:
-                    print("❌ Received invalid JSON:", message)
+                        log.debug("SERVER: %s", msg)
+                except orjson.JSONDecodeError:
+                    log.warning("❌ Received invalid JSON: %r", message)
         except websockets.exceptions.ConnectionClosed:
-            print("❌ Connection to server closed")
+            log.info("❌ Connection to server closed")
         except Exception as e:
-            print(f"❌ Error in message loop: {e}")
+            log.error(f"❌ Error in message loop: {e}")
 
     async def _send_relay(self, to, payload):
+        await self._send_frame(pack_relay(FRAME_JSON, to, [orjson.dumps(payload)]))
+
+    async def _send_frame(self, frame: bytes):
         await self.ensure_connected()
         if self.websocket:
-            msg = {"type": "relay", "to": to, "payload": payload}
-            await self.websocket.send(json.dumps(msg))
+            await self.websocket.send(frame)
+
+    async def _handle_frame(self, frame):
+        """Dispatch a binary relay frame from the server."""
+        try:
+            typ, sender, body = unpack_relay(frame)
+            if typ == FRAME_CIPHERTEXT:
+                nonce, ct_b = unpack_ciphertext(body)
+            elif typ == FRAME_JSON:
+                payload = orjson.loads(body)
+            else:
+                log.warning(f"⚠️ Unknown frame type {typ} from {sender}")
+                return
+        except Exception:
+            log.warning("❌ bad relay frame")
+            return
+        if typ == FRAME_CIPHERTEXT:
+            await self._open(sender, nonce, ct_b)
+        else:
+            await self._handle_incoming(sender, payload)
 
     def has_session(self, peer: str) -> bool:
         return peer in self.sessions
 
+    def _start_session(self, peer: str, key: bytes, initiator: bool):
+        """
+        Install a freshly derived session key. Nonces are salt || 64-bit counter
+        (RFC 8439 partitioned construction); the salt's top bit encodes our role
+        so the two directions sharing this key can never collide.
+        """
+        salt = bytearray(secrets.token_bytes(4))
+        salt[0] = (salt[0] & 0x7F) | (0 if initiator else 0x80)
+        self.sessions[peer] = (key, _aead_new(key))
+        self._nonce_salt[peer] = bytes(salt)
+        self._nonce_ctr[peer] = 0
+
+    def _next_nonce(self, peer: str) -> bytes:
+        ctr = self._nonce_ctr[peer]
+        self._nonce_ctr[peer] = ctr + 1
+        return self._nonce_salt[peer] + struct.pack(">Q", ctr)
+
+    def _pair_id(self, peer: str) -> bytes:
+        """KDF info string for a peer; identical on both sides thanks to the sorted ordering."""
+        pair_id = self._pair_id_cache.get(peer)
+        if pair_id is None:
+            pair_id = f"session:{'|'.join(sorted([self.username, peer]))}".encode()
+            self._pair_id_cache[peer] = pair_id
+        return pair_id
+
+    async def _verify_signature(self, pub_b, sig_b, msg_b):
+        """
+        Verify a handshake signature in the executor, batched with any others
+        pending. Returns None if valid, otherwise the verification error.
+        """
+        pub = self._id_pub_cache.get(pub_b)
+        if pub is None:
+            try:
+                pub = ed25519.Ed25519PublicKey.from_public_bytes(pub_b)
+            except Exception as e:
+                return e
+            if len(self._id_pub_cache) >= ID_PUB_CACHE_MAX:
+                self._id_pub_cache.clear()
+            self._id_pub_cache[pub_b] = pub
+        return await submit_verify(pub, sig_b, msg_b)
+
     # ========== HANDSHAKE ==========
 
 
@@ -123,14 +364,14 @@ class ChatClient:
             await self._handle_chat_message(from_user, payload)
 
         else:
-            print(f"[WARN] Unknown payload type from {from_user}: {payload}")
+            log.warning(f"[WARN] Unknown payload type from {from_user}: {payload}")
 
     # 🔁 Relay unwrap
         if typ == "relay":
             payload = msg["payload"]
             sender = msg["from"]
             if sender not in self.sessions:
-                print(f"⚠️ No session key with {sender}")
+                log.warning(f"⚠️ No session key with {sender}")
                 await self._initiate_handshake(sender)
                 return
             try:
@@ -138,9 +379,9 @@ class ChatClient:
                 nonce = b64(payload["nonce"])
                 plaintext = self.sessions[sender].decrypt(ciphertext, nonce)
                 text = plaintext.decode()
-                print(f"[{sender}] → {text}")
+                log.debug("[%s] → %s", sender, text)
             except Exception as e:
-                print(f"❌ Failed to decrypt from {sender}: {e}")
+                log.error(f"❌ Failed to decrypt from {sender}: {e}")
                 return
         elif typ == "handshake-init":
             await self._handle_handshake_init(msg)
@@ -162,31 +403,27 @@ class ChatClient:
         Start a secure handshake with the given peer.
         Called by ws_gateway when browser initiates handshake.
         """
-        print(f"[🤝] Initiating handshake with {peer}")
+        log.debug(f"[🤝] Initiating handshake with {peer}")
 
     # Generate a fresh ephemeral key pair for this session
-        self.my_eph_priv = x25519.X25519PrivateKey.generate()
-        my_eph_pub = self.my_eph_priv.public_key().public_bytes(
-            encoding=ser.Encoding.Raw,
-            format=ser.PublicFormat.Raw
-        )
+        self.my_eph_priv, my_eph_pub = generate_ephemeral()
 
     # Sign our ephemeral public key using our long-term identity
-        sig = self.identity_priv.sign(my_eph_pub)
+        sig = self._sign(my_eph_pub)
 
     # Prepare handshake-init message
         obj = {
             "type": "handshake_init",
-            "identity": b64(self.identity_pub.public_bytes(
-                encoding=ser.Encoding.Raw, format=ser.PublicFormat.Raw
-            )),
+            "identity": self._identity_pub_b64,
             "ephemeral": b64(my_eph_pub),
             "sig": b64(sig)
         }
+        if self.fast_kdf:
+            obj["kdf"] = KDF_BLAKE2
 
     # Send via relay server
         await self._send_relay(peer, obj)
-        print(f"[SENT] Handshake-init to {peer}")
+        log.debug(f"[SENT] Handshake-init to {peer}")
 
 
     async def _handle_incoming(self, sender, payload):
@@ -200,7 +437,7 @@ class ChatClient:
             await self._handle_ciphertext(sender, payload)
         else:
         # unknown payload type: log for debugging
-            print(f"⚠️ Unknown payload type from {sender}: {payload}")
+            log.warning(f"⚠️ Unknown payload type from {sender}: {payload}")
 
 
     async def _handle_handshake_init(self, sender, payload):
@@ -209,58 +446,54 @@ class ChatClient:
         Verify signature, create our ephemeral, sign it, send handshake reply,
         compute shared secret and derive symmetric key.
         """
-        print(f"[🤝] Received handshake-init from {sender}")
+        log.debug(f"[🤝] Received handshake-init from {sender}")
         try:
             peer_id_b = ub64(payload["identity"])
             peer_eph_b = ub64(payload["ephemeral"])
             sig_b = ub64(payload["sig"])
         except Exception:
-            print("❌ bad handshake-init format")
+            log.warning("❌ bad handshake-init format")
             return
 
     # verify peer's signature on their ephemeral
-        try:
-            peer_id_pub = ed25519.Ed25519PublicKey.from_public_bytes(peer_id_b)
-            peer_id_pub.verify(sig_b, peer_eph_b)
-        except InvalidSignature:
-            print("❌ Invalid handshake-init signature")
+        err = await self._verify_signature(peer_id_b, sig_b, peer_eph_b)
+        if isinstance(err, InvalidSignature):
+            log.warning("❌ Invalid handshake-init signature")
             return
-        except Exception as e:
-            print("❌ Error verifying handshake-init signature:", e)
+        elif err is not None:
+            log.error(f"❌ Error verifying handshake-init signature: {err}")
             return
 
     # create our ephemeral, sign and send handshake reply
-        my_eph_priv = x25519.X25519PrivateKey.generate()
-        my_eph_pub = my_eph_priv.public_key().public_bytes(
-            encoding=ser.Encoding.Raw, format=ser.PublicFormat.Raw
-        )
-        sig = self.identity_priv.sign(my_eph_pub)
+        my_eph_priv, my_eph_pub = generate_ephemeral()
+        sig = self._sign(my_eph_pub)
 
         handshake = {
             "type": "handshake",
-            "identity": b64(self.identity_pub.public_bytes(
-                encoding=ser.Encoding.Raw, format=ser.PublicFormat.Raw)),
+            "identity": self._identity_pub_b64,
             "ephemeral": b64(my_eph_pub),
             "sig": b64(sig)
         }
+    # peers that don't advertise the BLAKE2b capability keep RFC 5869 HKDF
+        use_blake = self.fast_kdf and payload.get("kdf") == KDF_BLAKE2
+        if use_blake:
+            handshake["kdf"] = KDF_BLAKE2
 
     # send handshake reply back to initiator
         await self._send_relay(sender, handshake)
-        print(f"[SENT] Handshake reply to {sender}")
+        log.debug(f"[SENT] Handshake reply to {sender}")
 
     # compute shared secret (responder side)
         try:
-            peer_eph_pub = x25519.X25519PublicKey.from_public_bytes(peer_eph_b)
-            shared = my_eph_priv.exchange(peer_eph_pub)
+            shared = fast_x25519_exchange(my_eph_priv, peer_eph_b)
         except Exception as e:
-            print("❌ error computing shared secret (responder):", e)
+            log.error(f"❌ error computing shared secret (responder): {e}")
             return
 
     # derive symmetric key using identical pair_id ordering
-        pair_id = f"session:{'|'.join(sorted([self.username, sender]))}".encode()
-        key = derive_shared_key(shared, info=pair_id)
-        self.sessions[sender] = key
-        print(f"[🔐] Session key established with {sender} (responder)")
+        key = derive_shared_key(shared, info=self._pair_id(sender), use_blake=use_blake)
+        self._start_session(sender, key, initiator=False)
+        log.info(f"[🔐] Session key established with {sender} (responder)")
         # notify UI/gateway
         try:
             if hasattr(self, "on_message") and self.on_message:
@@ -279,41 +512,38 @@ class ChatClient:
         Verify signature, compute shared secret using stored my_eph_priv,
         derive symmetric key and clear ephemeral private.
         """
-        print(f"[🤝] Received handshake from {sender}")
+        log.debug(f"[🤝] Received handshake from {sender}")
         try:
             peer_id_b = ub64(payload["identity"])
             peer_eph_b = ub64(payload["ephemeral"])
             sig_b = ub64(payload["sig"])
         except Exception:
-            print("❌ bad handshake format")
+            log.warning("❌ bad handshake format")
             return
 
     # verify signature
-        try:
-            peer_id_pub = ed25519.Ed25519PublicKey.from_public_bytes(peer_id_b)
-            peer_id_pub.verify(sig_b, peer_eph_b)
-        except InvalidSignature:
-            print("❌ Invalid handshake signature")
+        err = await self._verify_signature(peer_id_b, sig_b, peer_eph_b)
+        if isinstance(err, InvalidSignature):
+            log.warning("❌ Invalid handshake signature")
             return
-        except Exception as e:
-            print("❌ Error verifying handshake signature:", e)
+        elif err is not None:
+            log.error(f"❌ Error verifying handshake signature: {err}")
             return
 
     # ensure we have stored our ephemeral private from initiate_handshake
         if not hasattr(self, "my_eph_priv") or self.my_eph_priv is None:
-            print("⚠️ No ephemeral key stored for initiator — cannot complete handshake")
+            log.warning("⚠️ No ephemeral key stored for initiator — cannot complete handshake")
             return
 
         try:
-            peer_eph_pub = x25519.X25519PublicKey.from_public_bytes(peer_eph_b)
-            shared = self.my_eph_priv.exchange(peer_eph_pub)
+            shared = fast_x25519_exchange(self.my_eph_priv, peer_eph_b)
         except Exception as e:
-            print("❌ error computing shared secret (initiator):", e)
+            log.error(f"❌ error computing shared secret (initiator): {e}")
             return
 
-        pair_id = f"session:{'|'.join(sorted([self.username, sender]))}".encode()
-        key = derive_shared_key(shared, info=pair_id)
-        self.sessions[sender] = key
+        use_blake = self.fast_kdf and payload.get("kdf") == KDF_BLAKE2
+        key = derive_shared_key(shared, info=self._pair_id(sender), use_blake=use_blake)
+        self._start_session(sender, key, initiator=True)
 
     # clear ephemeral private
         try:
@@ -321,7 +551,7 @@ class ChatClient:
         except Exception:
             pass
 
-        print(f"[🔐] Session key established with {sender} (initiator)")
+        log.info(f"[🔐] Session key established with {sender} (initiator)")
         # notify UI/gateway
         try:
             if hasattr(self, "on_message") and self.on_message:
@@ -344,19 +574,22 @@ class ChatClient:
             ct_b = ub64(payload["ct"])
             nonce = ub64(payload["nonce"])
         except Exception:
-            print("❌ bad ciphertext format")
+            log.warning("❌ bad ciphertext format")
             return
+        await self._open(sender, nonce, ct_b)
 
-        key = self.sessions.get(sender)
-        if not key:
-            print(f"⚠️ No session key with {sender} — cannot decrypt")
+    async def _open(self, sender, nonce, ct_b):
+        """Decrypt a ciphertext from sender and route it to on_message."""
+        session = self.sessions.get(sender)
+        if not session:
+            log.warning(f"⚠️ No session key with {sender} — cannot decrypt")
             return
+        _, aead = session
 
-        aead = ChaCha20Poly1305(key)
         try:
-            pt = aead.decrypt(nonce, ct_b, None)
+            pt = _aead_decrypt(aead, nonce, ct_b)
             plaintext = pt.decode()
-            print(f"[{sender}] -> {plaintext}")
+            log.debug("[%s] -> %s", sender, plaintext)
 
         # notify UI / terminal
             if hasattr(self, "on_message") and self.on_message:
@@ -367,26 +600,15 @@ class ChatClient:
                     self.on_message(msg_obj)
 
         except Exception as e:
-            print("❌ decryption failed:", e)
+            log.error(f"❌ decryption failed: {e}")
     
 
-    async def send_message(self, peer, plaintext):
-        key = self.sessions.get(peer)
-        if not key:
-            print("⚠️ No session key with", peer, "- initiate handshake first.")
-            return
+    def _seal(self, peer, aead, nonce, plaintext):
+        """Encrypt one message and append its encrypted log entry; returns the relay frame."""
+        ciphertext = _aead_encrypt(aead, nonce, plaintext.encode())
 
-    # Encrypt the message
-        aead = ChaCha20Poly1305(key)
-        nonce = secrets.token_bytes(12)
-        ciphertext = aead.encrypt(nonce, plaintext.encode(), None)
-
-    # Prepare payload for sending over the network
-        payload = {
-            "type": "ciphertext",
-            "nonce": b64(nonce),
-            "ct": b64(ciphertext)
-        }
+    # Binary relay frame: raw nonce/ct, no base64 on the wire
+        frame = pack_ciphertext(peer, nonce, ciphertext)
 
     # 🔐 Encrypted log entry (no plaintext)
         log_entry = {
@@ -397,23 +619,103 @@ class ChatClient:
             "timestamp": datetime.datetime.now().isoformat()
         }
 
-    # Append encrypted message to file
-        with open("messages.log", "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
+    # Queue encrypted message for the background log writer
+        self._log_q.put_nowait(orjson.dumps(log_entry) + b"\n")
+
+        return frame
+
+    async def send_message(self, peer, plaintext):
+        session = self.sessions.get(peer)
+        if not session:
+            log.warning(f"⚠️ No session key with {peer} - initiate handshake first.")
+            return
+        _, aead = session
+
+    # Encrypt the message
+        nonce = self._next_nonce(peer)
+        frame = self._seal(peer, aead, nonce, plaintext)
 
     # Send encrypted message
-        await self._send_relay(peer, payload)
-        print(f"[🕊️ SENT] to {peer}: (encrypted)")
+        await self._send_frame(frame)
+        log.debug("[🕊️ SENT] to %s: (encrypted)", peer)
+
+    async def send_many(self, peer, msgs):
+        """
+        Encrypt and send a backlog of messages to one peer.
+        All messages are sealed back to back before any of them hit the network.
+        """
+        session = self.sessions.get(peer)
+        if not session:
+            log.warning(f"⚠️ No session key with {peer} - initiate handshake first.")
+            return
+        _, aead = session
+        if not msgs:
+            return
+
+        frames = [self._seal(peer, aead, self._next_nonce(peer), text) for text in msgs]
+
+        for frame in frames:
+            await self._send_frame(frame)
+        log.debug("[🕊️ SENT] %d messages to %s: (encrypted)", len(frames), peer)
             
             
 
 
 # ========== CLI ==========
 
+def stdin_lines(loop):
+    """
+    Return (queue, stop): stdin lines are pushed onto the asyncio queue as they
+    arrive ("" on EOF). Uses loop.add_reader where supported, otherwise (e.g.
+    the Windows proactor loop) a single dedicated reader thread.
+    """
+    queue = asyncio.Queue()
+    fd = sys.stdin.fileno()
+    buf = bytearray()
+
+    def on_readable():
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            if buf:
+                queue.put_nowait(buf.decode(errors="replace"))
+                buf.clear()
+            queue.put_nowait("")
+            loop.remove_reader(fd)
+            return
+        buf.extend(chunk)
+        while (nl := buf.find(b"\n")) >= 0:
+            queue.put_nowait(buf[:nl + 1].decode(errors="replace"))
+            del buf[:nl + 1]
+
+    try:
+        loop.add_reader(fd, on_readable)
+        return queue, lambda: loop.remove_reader(fd)
+    except (NotImplementedError, OSError):
+        # NotImplementedError: proactor loop; OSError (EPERM): epoll refuses
+        # regular files, e.g. `python client.py carol < cmds.txt`
+        pass
+
+    def pump():
+        while True:
+            line = sys.stdin.readline()
+            loop.call_soon_threadsafe(queue.put_nowait, line)
+            if not line:
+                break
+
+    threading.Thread(target=pump, daemon=True).start()
+    return queue, lambda: None
+
 async def repl_loop(client: ChatClient):
     print("Commands:\n  /handshake <peer>\n  /send <peer> <message>\n  /exit\n")
+    lines, stop_reading = stdin_lines(asyncio.get_running_loop())
+    try:
+        await _repl(client, lines)
+    finally:
+        stop_reading()
+
+async def _repl(client: ChatClient, lines):
     while True:
-        line = await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
+        line = await lines.get()
         if not line:
             break
         line = line.strip()
@@ -443,6 +745,13 @@ async def main():
     await repl_loop(client)
 
 if __name__ == "__main__":
+    _console = logging.StreamHandler(sys.stdout)
+    _console.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_console)
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    if uvloop is not None:
+        uvloop.install()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -0,0 +1,83 @@
+"""
+Binary relay framing shared by client.py and server.py.
+
+    u8 typ | u8 peer_len | peer (utf-8) | body
+
+On frames sent to the server `peer` is the recipient; the server swaps in the
+sender's name when forwarding. JSON frames always start with "{", which is
+never a valid frame type, so both kinds can share one connection. The server
+only ever reads the header: bodies are opaque to it.
+
+FRAME_JSON body: an orjson-encoded payload (handshakes, other control data).
+
+FRAME_CIPHERTEXT body:
+
+    u16 nonce_len | nonce | u32 ct_len | ct
+"""
+import struct
+
+FRAME_CIPHERTEXT = 0x01
+FRAME_JSON = 0x02
+FRAME_TYPES = frozenset({FRAME_CIPHERTEXT, FRAME_JSON})
+MAX_PEER_LEN = 255
+
+# compiled once: avoids re-parsing the format string on every frame
+_RELAY_HDR = struct.Struct(">BB")
+_NONCE_LEN = struct.Struct(">H")
+_CT_LEN = struct.Struct(">I")
+
+
+def is_relay_frame(raw) -> bool:
+    return isinstance(raw, (bytes, bytearray)) and len(raw) > 0 and raw[0] in FRAME_TYPES
+
+
+def relay_header(typ: int, peer_b: bytes) -> bytes:
+    if len(peer_b) > MAX_PEER_LEN:
+        raise ValueError("peer name too long for relay frame")
+    return _RELAY_HDR.pack(typ, len(peer_b)) + peer_b
+
+
+def pack_relay(typ: int, peer: str, parts: list[bytes]) -> bytes:
+    return b"".join([relay_header(typ, peer.encode()), *parts])
+
+
+def unpack_relay(frame):
+    """Split a relay frame into (typ, peer, body); body is a zero-copy memoryview."""
+    view = memoryview(frame)
+    if len(view) < 2:
+        raise ValueError("truncated relay frame")
+    typ, peer_len = _RELAY_HDR.unpack_from(view, 0)
+    end = 2 + peer_len
+    if len(view) < end:
+        raise ValueError("truncated relay frame")
+    return typ, bytes(view[2:end]).decode(), view[end:]
+
+
+def pack_ciphertext(peer: str, nonce: bytes, ct: bytes) -> bytearray:
+    """Build a FRAME_CIPHERTEXT frame in one preallocated buffer."""
+    peer_b = peer.encode()
+    if len(peer_b) > MAX_PEER_LEN:
+        raise ValueError("peer name too long for relay frame")
+    pos = _RELAY_HDR.size + len(peer_b)
+    buf = bytearray(pos + _NONCE_LEN.size + len(nonce) + _CT_LEN.size + len(ct))
+    _RELAY_HDR.pack_into(buf, 0, FRAME_CIPHERTEXT, len(peer_b))
+    buf[_RELAY_HDR.size:pos] = peer_b
+    _NONCE_LEN.pack_into(buf, pos, len(nonce))
+    pos += _NONCE_LEN.size
+    buf[pos:pos + len(nonce)] = nonce
+    pos += len(nonce)
+    _CT_LEN.pack_into(buf, pos, len(ct))
+    pos += _CT_LEN.size
+    buf[pos:] = ct
+    return buf
+
+
+def unpack_ciphertext(body):
+    """Return (nonce, ct) from a FRAME_CIPHERTEXT body."""
+    (nonce_len,) = _NONCE_LEN.unpack_from(body, 0)
+    pos = _NONCE_LEN.size + nonce_len
+    (ct_len,) = _CT_LEN.unpack_from(body, pos)
+    pos += _CT_LEN.size
+    if len(body) != pos + ct_len:
+        raise ValueError("bad ciphertext frame length")
+    return bytes(body[_NONCE_LEN.size:_NONCE_LEN.size + nonce_len]), bytes(body[pos:])
@@ -1,30 +1,43 @@
 import asyncio
-import json
+import orjson
 import websockets
 from websockets.exceptions import ConnectionClosed
+from framing import FRAME_TYPES, MAX_PEER_LEN, is_relay_frame, relay_header, unpack_relay
+
+try:
+    import uvloop
+except ImportError:  # uvloop is unavailable on Windows
+    uvloop = None
 
 
 clients = {}  # username -> websocket
+_user_list_frame = None  # encoded user_list, rebuilt after register/disconnect
 
 
 async def send(ws, message: dict):
-    """Send JSON message to a WebSocket client."""
+    """Send JSON message to a WebSocket client as a binary frame."""
     try:
-        await ws.send(json.dumps(message))
+        await ws.send(orjson.dumps(message))
     except Exception:
         pass
 
 
+def users_changed():
+    """Drop the cached user_list frame; call whenever `clients` is mutated."""
+    global _user_list_frame
+    _user_list_frame = None
+
+
 async def broadcast_user_list():
-    """Send updated user list to all connected clients."""
-    users = list(clients.keys())
-    msg = {"type": "user_list", "users": users}
+    """Send updated user list to all connected clients, concurrently."""
+    global _user_list_frame
+    if _user_list_frame is None:
+        _user_list_frame = orjson.dumps({"type": "user_list", "users": list(clients)})
 
-    for ws in list(clients.values()):
-        try:
-            await send(ws, msg)
-        except:
-            pass
+    await asyncio.gather(
+        *[ws.send(_user_list_frame) for ws in list(clients.values())],
+        return_exceptions=True,
+    )
 
 
 async def handler(websocket, path):
@@ -35,7 +48,7 @@ async def handler(websocket, path):
     try:
         # First message must be register
         raw = await websocket.recv()
-        msg = json.loads(raw)
+        msg = orjson.loads(raw)
 
         if msg.get("type") != "register" or "username" not in msg:
             await send(websocket, {"type": "error", "message": "First message must be register"})
@@ -44,20 +57,50 @@ async def handler(websocket, path):
 
         username = msg["username"]
 
+        username_b = username.encode()
+        if len(username_b) > MAX_PEER_LEN:
+            await send(websocket, {"type": "error", "message": "Username too long"})
+            await websocket.close()
+            return
+
+        # sender headers for every frame type, built once per connection
+        sender_hdrs = {typ: relay_header(typ, username_b) for typ in FRAME_TYPES}
+
         if username in clients:
             await send(websocket, {"type": "error", "message": "Username already taken"})
             await websocket.close()
             return
 
         clients[username] = websocket
+        users_changed()
         print(f"✅ {username} registered")
         await broadcast_user_list()
 
         # Main loop
         async for raw in websocket:
+            # Binary relay frame: route on the header, forward the opaque body
+            # behind a sender header -- no JSON parse, no dict rebuild
+            if is_relay_frame(raw):
+                try:
+                    typ, target, body = unpack_relay(raw)
+                except ValueError:
+                    await send(websocket, {"type": "error", "message": "Invalid relay frame"})
+                    continue
+                if target in clients:
+                    try:
+                        await clients[target].send(sender_hdrs[typ] + body)
+                    except Exception:
+                        pass
+                else:
+                    await send(websocket, {
+                        "type": "error",
+                        "message": f"User '{target}' is offline"
+                    })
+                continue
+
             try:
-                obj = json.loads(raw)
-            except json.JSONDecodeError:
+                obj = orjson.loads(raw)
+            except orjson.JSONDecodeError:
                 await send(websocket, {"type": "error", "message": "Invalid JSON"})
                 continue
 
@@ -85,16 +128,19 @@ async def handler(websocket, path):
     finally:
         if username in clients:
             del clients[username]
+            users_changed()
             await broadcast_user_list()
 
 
 async def main():
     print("🚀 Starting WebSocket server on ws://0.0.0.0:9000")
-    async with websockets.serve(handler, "0.0.0.0", 9000):
+    async with websockets.serve(handler, "0.0.0.0", 9000, max_size=2**20, compression=None):
         await asyncio.Future()  # run forever
 
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.install()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -50,9 +50,11 @@ function handleUserList(users: unknown) {
     console.error("❌ Invalid user list format; expected array:", users);
     return;
   }
+  // The server broadcasts one shared list to everyone, including ourselves
+  const others = (users as string[]).filter((u) => u !== currentUsername);
   if (userListHandler) {
     try {
-      userListHandler(users as string[]);
+      userListHandler(others);
     } catch (err) {
       console.error("❌ Error in userListHandler:", err);
     }
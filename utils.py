@@ -1,4 +1,5 @@
 import base64
+import hashlib
 import os
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
@@ -6,29 +7,55 @@ from cryptography.hazmat.primitives.asymmetric import ed25519
 from cryptography.hazmat.primitives import serialization as ser
 
 # === BASE64 helpers ===
-def b64(b: bytes) -> str:
-    return base64.b64encode(b).decode()
+# pybase64 (SIMD codec) when installed, stdlib otherwise
+try:
+    import pybase64
 
-def ub64(s: str) -> bytes:
-    return base64.b64decode(s.encode())
+    def b64(b: bytes) -> str:
+        return pybase64.b64encode_as_string(b)
+
+    def ub64(s: str) -> bytes:
+        return pybase64.b64decode(s, validate=False)
+except ImportError:
+    def b64(b: bytes) -> str:
+        return base64.b64encode(b).decode()
+
+    def ub64(s: str) -> bytes:
+        return base64.b64decode(s.encode())
 
 # === Derive symmetric key from shared secret ===
-def derive_shared_key(shared_secret: bytes, info: bytes = b"session") -> bytes:
+def derive_shared_key(shared_secret: bytes, info: bytes = b"session", length: int = 32,
+                      use_blake: bool = False) -> bytes:
+    if use_blake:
+        # keyed BLAKE2b as the PRF: shared secret is the key, info the message
+        return hashlib.blake2b(info, key=shared_secret, digest_size=length).digest()
     hkdf = HKDF(
         algorithm=hashes.SHA256(),
-        length=32,
+        length=length,
         salt=None,
         info=info
     )
     return hkdf.derive(shared_secret)
 
 # === Identity key management ===
+_identity_cache: dict[str, ed25519.Ed25519PrivateKey] = {}  # abspath -> parsed key
+
 def load_or_create_identity(path="identity_ed25519.key"):
-    """Load existing Ed25519 private key or create a new one."""
+    """Load existing Ed25519 private key or create a new one; parsed once per path."""
+    cache_key = os.path.abspath(path)
+    priv = _identity_cache.get(cache_key)
+    if priv is None:
+        priv = _identity_cache[cache_key] = _load_or_create_identity(path)
+    return priv
+
+def _load_or_create_identity(path):
     if os.path.exists(path):
         with open(path, "rb") as f:
             data = f.read()
-        return ser.load_pem_private_key(data, password=None)
+        priv = ser.load_pem_private_key(data, password=None)
+        if not isinstance(priv, ed25519.Ed25519PrivateKey):
+            raise RuntimeError("Identity key is not Ed25519")
+        return priv
     else:
         priv = ed25519.Ed25519PrivateKey.generate()
         pem = priv.private_bytes(
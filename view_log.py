@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 import json
+import mmap
+import os
+import orjson
 import argparse
 from pathlib import Path
 
@@ -10,10 +13,31 @@ def iter_logs(path):
             if not line: 
                 continue
             try:
-                yield json.loads(line)
+                yield orjson.loads(line)
             except Exception as e:
                 print("bad json line:", e, line[:200])
 
+def tail_logs(path, n):
+    """Return the last n entries, scanning backward from EOF instead of reading the whole file."""
+    entries = []
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return entries
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm)
+            while end > 0 and len(entries) < n:
+                start = mm.rfind(b'\n', 0, end) + 1
+                line = mm[start:end].strip()
+                end = start - 1
+                if not line:
+                    continue
+                try:
+                    entries.append(orjson.loads(line))
+                except Exception as e:
+                    print("bad json line:", e, line[:200])
+    entries.reverse()
+    return entries
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--file', default='messages.log')
@@ -22,10 +46,10 @@ def main():
     p.add_argument('--tail', type=int, help='show last N entries (scans file)')
     args = p.parse_args()
 
-    logs = list(iter_logs(args.file))
-
     if args.tail:
-        logs = logs[-args.tail:]
+        logs = tail_logs(args.file, args.tail)
+    else:
+        logs = iter_logs(args.file)
 
     for entry in logs:
         if args.from_user and entry.get('from') != args.from_user:
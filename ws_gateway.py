@@ -1,23 +1,56 @@
 import asyncio
-import json
-import traceback
+import orjson
 import datetime
+import logging
+import logging.handlers
 import os
-import requests
+import queue
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any
+import aiohttp
 from dotenv import load_dotenv
 import websockets
 from websockets.exceptions import ConnectionClosed
-from urllib.parse import parse_qs, urlparse
+from urllib.parse import unquote_plus
 from websockets.http import Headers
 from client import ChatClient
-print("WEBSOCKETS MODULE LOADED:", websockets)   # ⚠️ Must be updated to WebSocket soon
 
-clients = {}        # username -> websocket
-chat_clients = {}   # username -> ChatClient
-message_log = []    # For runtime log
+try:
+    import uvloop
+except ImportError:  # uvloop is unavailable on Windows
+    uvloop = None
+
+try:
+    import ormsgpack  # optional: lets clients negotiate the "msgpack" subprotocol
+except ImportError:
+    ormsgpack = None
+
+
+
+@dataclass(slots=True)
+class Session:
+    """Per-connection state for one browser user."""
+    username: str
+    ws: Any
+    chat: ChatClient | None = None
+    pending: dict[str, deque[str]] = field(default_factory=dict)  # peer -> texts awaiting handshake
+
+
+sessions: dict[str, Session] = {}  # username -> Session
+PENDING_MAX = 256  # queued texts per peer while a handshake is outstanding
+message_log = deque(maxlen=10_000)    # For runtime log
 LOG_FILE = "messages.log"
+LOG_Q: asyncio.Queue[bytes] = asyncio.Queue()  # encoded log lines, drained by log_writer()
 AI_BOT_NAME = "AI_BOT"
-groups: dict[str, dict] = {}  # groupId -> { name: str, members: set[str] }
+FRAME_CACHE_MAX = 256  # encoded user_list frames kept for identical re-broadcasts
+_frame_cache: OrderedDict[tuple, str | bytes] = OrderedDict()
+SEND_TIMEOUT = 5  # seconds a broadcast waits on one client before dropping it
+USER_LIST_DEBOUNCE = 0.05  # seconds; connects/disconnects inside one window share a broadcast
+_user_list_task: asyncio.Task | None = None
+groups: dict[str, dict] = {}  # groupId -> { name: str, members: set[str], snapshot: tuple[str, ...] }
+_group_list_frames: dict[str, str | bytes] = {}  # username -> encoded group_list; dropped when their groups change
 
 # Load environment variables from .env if present
 load_dotenv()
@@ -25,80 +58,432 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "meta-llama/llama-3.1-8b-instruct")
 
+# Logging goes through a queue; a listener thread does the actual stream writes,
+# so log calls from the gateway and from its per-user ChatClients (the "chat"
+# logger) don't write to stdout/stderr on the event loop. Set LOG_LEVEL=DEBUG
+# for the per-message and per-request traces.
+_log_queue = queue.SimpleQueue()
+_log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+log = logging.getLogger("ws")
+for _logger in (log, logging.getLogger("chat")):
+    _logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+    _logger.setLevel(_log_level)
+    _logger.propagate = False
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+log.debug("WEBSOCKETS MODULE LOADED: %s", websockets)   # ⚠️ Must be updated to WebSocket soon
+AIO_SESSION: aiohttp.ClientSession | None = None  # shared HTTP client, opened in main()
+# Built once; aiohttp does not mutate the headers mapping it is given
+BASE_HEADERS = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json",
+    "HTTP-Referer": "http://localhost:5173",
+    "X-Title": "Secure Chat App"
+}
+SYSTEM_MSG = {"role": "system", "content": "You are a helpful, concise assistant in a messaging app."}
+AI_CACHE_MAX = 1024  # (model, prompt) -> reply entries kept for repeated prompts
+AI_CACHE_TTL = 300   # seconds
+_ai_cache: OrderedDict[tuple[str, str], tuple[float, str]] = OrderedDict()
+
 
 # ----------------------
 # Utility Functions
 # ----------------------
 
+_TS_CACHE = ["", 0.0]  # [iso string, time.time() it was formatted at]
+
+
+def now_iso() -> str:
+    """UTC ISO timestamp, reformatted at most once per millisecond."""
+    t = time.time()
+    if t - _TS_CACHE[1] > 0.001:
+        _TS_CACHE[0] = datetime.datetime.utcfromtimestamp(t).isoformat()
+        _TS_CACHE[1] = t
+    return _TS_CACHE[0]
+
+
+def _dumps(obj) -> str:
+    """Encode a frame for the browser; it JSON.parse()s text frames, so keep them str."""
+    return orjson.dumps(obj).decode()
+
+
+# Wire format is picked per connection through the WebSocket subprotocol.
+# Clients that ask for nothing (the browser UI) get JSON text frames; clients
+# offering "msgpack" get binary MessagePack frames when ormsgpack is installed.
+PROTO_JSON = "json"
+PROTO_MSGPACK = "msgpack"
+ENCODERS = {PROTO_JSON: _dumps}
+DECODERS = {PROTO_JSON: orjson.loads}
+DECODE_ERRORS: tuple[type[Exception], ...] = (orjson.JSONDecodeError,)
+if ormsgpack is not None:
+    ENCODERS[PROTO_MSGPACK] = ormsgpack.packb
+    DECODERS[PROTO_MSGPACK] = ormsgpack.unpackb
+    DECODE_ERRORS += (ormsgpack.MsgpackDecodeError,)
+SUBPROTOCOLS = [p for p in (PROTO_MSGPACK, PROTO_JSON) if p in ENCODERS]
+
+
+def proto_of(ws) -> str:
+    return ws.subprotocol or PROTO_JSON
+
+
+def frame_encoder(payload):
+    """Return proto -> encoded frame for `payload`, encoding at most once per protocol."""
+    frames = {}
+
+    def frame(proto: str):
+        f = frames.get(proto)
+        if f is None:
+            f = frames[proto] = ENCODERS[proto](payload)
+        return f
+    return frame
+
+
+def cached_frame(key: tuple, build, proto: str = PROTO_JSON):
+    """Return the encoded frame for `key`, calling build() and encoding only on a miss (LRU)."""
+    key = (proto, *key)
+    frame = _frame_cache.get(key)
+    if frame is None:
+        frame = _frame_cache[key] = ENCODERS[proto](build())
+        if len(_frame_cache) > FRAME_CACHE_MAX:
+            _frame_cache.popitem(last=False)
+    else:
+        _frame_cache.move_to_end(key)
+    return frame
+
+
 def log_to_file(entry):
+    """Queue a log entry; log_writer() appends it in the background."""
+    LOG_Q.put_nowait(orjson.dumps(entry) + b"\n")
+
+
+def _append_blob(blob: bytes):
     try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry) + "\n")
+        with open(LOG_FILE, "ab") as f:
+            f.write(blob)
     except Exception as e:
-        print(f"[ERROR] Failed to write log: {e}")
+        log.error(f"Failed to write log: {e}")
+
+
+def _drain_log_queue() -> bytes:
+    lines = []
+    try:
+        while True:
+            lines.append(LOG_Q.get_nowait())
+    except asyncio.QueueEmpty:
+        pass
+    return b"".join(lines)
+
+
+async def log_writer():
+    """Batch queued log lines into one write, performed off the event loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        first = await LOG_Q.get()
+        await loop.run_in_executor(None, _append_blob, first + _drain_log_queue())
+
+
+def schedule_user_list_broadcast():
+    """Coalesce user_list broadcasts: at most one is pending at any time."""
+    global _user_list_task
+    if _user_list_task is None:
+        _user_list_task = asyncio.create_task(_debounced_user_list())
+
+
+async def _debounced_user_list():
+    global _user_list_task
+    await asyncio.sleep(USER_LIST_DEBOUNCE)
+    _user_list_task = None  # changes from here on schedule a fresh broadcast
+    await broadcast_user_list()
 
 
 async def broadcast_user_list():
-    """Send list of connected users to all clients"""
-    current_users = list(clients.keys())
-    print(f"[USER LIST] Broadcasting to {len(clients)} clients: {current_users}")
-
-    for username, ws in list(clients.items()):
-        others = [u for u in current_users if u != username]
-        # Ensure AI bot is visible to each user
-        if AI_BOT_NAME not in others:
-            others.append(AI_BOT_NAME)
-        sent = await safe_send(ws, {
-            "type": "user_list",
-            "users": others
-        }, username_for_cleanup=username)
-        if not sent:
-            print(f"[WARN] Failed to send user_list to {username}; cleaned up if necessary")
+    """Send list of connected users to all clients (each client filters itself out)"""
+    current_users = list(sessions)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"[USER LIST] Broadcasting to {len(sessions)} clients: {current_users}")
+
+    # Ensure AI bot is visible to each user; one frame serialized per wire format
+    def build():
+        return {"type": "user_list", "users": current_users + [AI_BOT_NAME]}
+    frames = {}
+
+    def frame(proto):
+        if proto not in frames:
+            frames[proto] = cached_frame(("user_list", *current_users), build, proto)
+        return frames[proto]
+
+    # Send to a snapshot, each send bounded so one stuck client can't hold up the rest
+    recipients = tuple(sessions.values())
+    results = await asyncio.gather(
+        *(asyncio.wait_for(sess.ws.send(frame(proto_of(sess.ws))), SEND_TIMEOUT) for sess in recipients),
+        return_exceptions=True,
+    )
+    for sess, res in zip(recipients, results):
+        if isinstance(res, BaseException):
+            log.warning(f"Failed to send user_list to {sess.username}: {res!r}")
+            await cleanup_user(sess.username, sess)
 
 async def send_group_list(username: str):
     """Send groups that the user is a member of."""
     try:
-        ws = clients.get(username)
-        if not ws:
+        sess = sessions.get(username)
+        if not sess:
             return
-        user_groups = [gid for gid, g in groups.items() if username in g["members"]]
-        await safe_send(ws, {"type": "group_list", "groups": [
-            {"id": gid, "name": groups[gid]["name"], "members": list(groups[gid]["members"])}
-            for gid in user_groups
-        ]})
+        frame = _group_list_frames.get(username)
+        if frame is None:
+            frame = _group_list_frames[username] = ENCODERS[proto_of(sess.ws)]({"type": "group_list", "groups": [
+                {"id": gid, "name": g["name"], "members": list(g["snapshot"])}
+                for gid, g in groups.items() if username in g["members"]
+            ]})
+        await safe_send_frame(sess.ws, frame)
     except Exception as e:
-        print(f"[WARN] send_group_list error for {username}: {e}")
+        log.warning(f"send_group_list error for {username}: {e}")
+
+
+def invalidate_group_lists(members):
+    """Forget cached group_list frames for users whose groups just changed."""
+    for m in members:
+        _group_list_frames.pop(m, None)
+
+
+async def notify_group_members(members, event):
+    """Refresh each member's group list, then send them `event`; members run concurrently."""
+    frame = frame_encoder(event)  # serialized once per wire format, not per member
+
+    async def notify(member):
+        await send_group_list(member)
+        sess = sessions.get(member)
+        if sess:
+            await safe_send_frame(sess.ws, frame(proto_of(sess.ws)))
+
+    await asyncio.gather(*(notify(m) for m in members), return_exceptions=True)
+
+
 # Safe send helper to avoid crashes on closed connections
 async def safe_send(ws, payload, *, username_for_cleanup: str | None = None) -> bool:
+    return await safe_send_frame(ws, ENCODERS[proto_of(ws)](payload), username_for_cleanup=username_for_cleanup)
+
+
+async def safe_send_frame(ws, frame, *, username_for_cleanup: str | None = None) -> bool:
     try:
-        await ws.send(json.dumps(payload))
+        await ws.send(frame)
         return True
     except Exception as e:
-        print(f"[WARN] send failed: {e}")
+        log.warning(f"send failed: {e}")
         if username_for_cleanup:
-            await cleanup_user(username_for_cleanup)
+            sess = sessions.get(username_for_cleanup)
+            if sess is not None and sess.ws is ws:
+                await cleanup_user(username_for_cleanup, sess)
         return False
 
 
 
-async def cleanup_user(username):
-    """Cleanup user and notify others"""
-    if username in clients:
-        del clients[username]
-
-    if username in chat_clients:
-        client = chat_clients.pop(username)
+async def cleanup_user(username, sess: Session):
+    """
+    Cleanup one connection and notify others. The name is only released if it
+    still belongs to `sess`, so a stale connection can't evict a newer one.
+    """
+    if sessions.get(username) is sess:
+        del sessions[username]
+        _group_list_frames.pop(username, None)
+    if not sess.ws.closed:
+        # e.g. a send timed out: drop the socket so its handler ends too
+        sess.ws.transport.abort()
+    if sess.chat:
         try:
-            close_method = getattr(client, "close", None)
+            close_method = getattr(sess.chat, "close", None)
             if close_method:
                 result = close_method()
                 if asyncio.iscoroutine(result):
                     await result
         except Exception as e:
-            print(f"[WARN] Error closing chat client for {username}: {e}")
+            log.warning(f"Error closing chat client for {username}: {e}")
 
-    await broadcast_user_list()
-    print(f"[CLEANUP] {username} disconnected")
+    schedule_user_list_broadcast()
+    log.info(f"[CLEANUP] {username} disconnected")
+
+
+# ----------------------
+# Browser message handlers: HANDLERS[type](sess, data)
+# ----------------------
+
+async def _ai_reply(sess: Session, text):
+    """Answer a message addressed to the AI bot locally (no encryption)."""
+    reply_text = None
+    if text:
+        key = (OPENROUTER_MODEL, text)
+        cached = _ai_cache.get(key)
+        if cached and time.monotonic() - cached[0] < AI_CACHE_TTL:
+            _ai_cache.move_to_end(key)
+            reply_text = cached[1]
+        else:
+            # Compose prompt
+            payload = {
+                "model": OPENROUTER_MODEL,
+                "messages": [SYSTEM_MSG, {"role": "user", "content": text}]
+            }
+            try:
+                async with AIO_SESSION.post(OPENROUTER_URL, headers=BASE_HEADERS, json=payload) as res:
+                    data_out = await res.json(content_type=None)
+                reply_text = data_out.get("choices", [{}])[0].get("message", {}).get("content")
+            except Exception as e:
+                log.error(f"[AI] {e}")
+                reply_text = "⚠️ AI service unavailable, please try again later."
+            else:
+                if reply_text:  # only real answers are cached, never errors
+                    _ai_cache[key] = (time.monotonic(), reply_text)
+                    _ai_cache.move_to_end(key)
+                    if len(_ai_cache) > AI_CACHE_MAX:
+                        _ai_cache.popitem(last=False)
+                else:
+                    reply_text = "(No response)"
+
+    # Send bot reply back to this user as a normal relay
+    await safe_send(sess.ws, {
+        "type": "relay",
+        "from": AI_BOT_NAME,
+        "payload": {"text": reply_text or "(image received)"},
+        "timestamp": now_iso(),
+    }, username_for_cleanup=sess.username)
+
+
+async def _handle_message(sess: Session, data):
+    username = sess.username
+    peer = data.get("to")
+    text = data.get("text")
+    image = data.get("image")
+    if peer == AI_BOT_NAME and (text or image):
+        await _ai_reply(sess, text)
+    elif peer and text:
+        try:
+            if sess.chat.has_session(peer):
+                await sess.chat.send_message(peer, text)
+                log.debug("[MSG] %s -> %s: (encrypted)", username, peer)
+            else:
+                # queue and initiate handshake
+                queued = sess.pending.setdefault(peer, deque(maxlen=PENDING_MAX))
+                if len(queued) == PENDING_MAX:
+                    await safe_send(sess.ws, {"type": "error", "message": f"Queue full for {peer}, message dropped"})
+                    return
+                queued.append(text)
+                await sess.chat.initiate_handshake(peer)
+                await safe_send(sess.ws, {"type": "system", "text": f"Initiating handshake with {peer}..."})
+        except Exception as e:
+            log.error(f"send_message failed: {e}")
+    elif peer and image:
+        # For now, relay images in plaintext to peer via gateway
+        target = sessions.get(peer)
+        if target:
+            sent = await safe_send(target.ws, {
+                "type": "relay",
+                "from": username,
+                "payload": {"image": image}
+            }, username_for_cleanup=peer)
+            if sent:
+                log.debug("[IMG] %s -> %s: (relayed image)", username, peer)
+    else:
+        await safe_send(sess.ws, {"type": "error", "message": "Missing peer, text or image"}, username_for_cleanup=username)
+
+
+async def _handle_handshake(sess: Session, data):
+    peer = data.get("peer")
+    if peer == AI_BOT_NAME:
+        # Instantly succeed handshakes to AI bot
+        await safe_send(sess.ws, {"type": "handshake_success", "peer": AI_BOT_NAME, "timestamp": now_iso()})
+    elif peer in sessions:
+        await sess.chat.initiate_handshake(peer)
+    else:
+        await safe_send(sess.ws, {
+            "type": "error",
+            "message": f"{peer} is offline"
+        }, username_for_cleanup=sess.username)
+
+
+async def _handle_create_group(sess: Session, data):
+    # { type, groupId?, name, members: [user...] }
+    username = sess.username
+    name = (data.get("name") or "Group").strip() or "Group"
+    group_id = data.get("groupId") or f"grp:{username}:{int(datetime.datetime.utcnow().timestamp())}"
+    member_list = set(filter(None, [username] + list(data.get("members") or [])))
+    # Validate all members exist (must be connected users or AI bot)
+    invalid = [m for m in member_list if m != AI_BOT_NAME and m not in sessions]
+    if invalid:
+        await safe_send(sess.ws, {
+            "type": "error",
+            "message": f"Invalid users in group: {', '.join(invalid)}"
+        }, username_for_cleanup=username)
+        return
+    snapshot = tuple(member_list)
+    old = groups.get(group_id)
+    if old:  # re-created under the same id: former members see the change too
+        invalidate_group_lists(old["snapshot"])
+    groups[group_id] = {"name": name, "members": member_list, "snapshot": snapshot}
+    invalidate_group_lists(snapshot)
+    # notify members
+    await notify_group_members(snapshot, {"type": "group_added", "group": {"id": group_id, "name": name, "members": list(snapshot)}})
+
+
+async def _handle_join_group(sess: Session, data):
+    gid = data.get("groupId")
+    g = groups.get(gid)
+    if g:
+        g["members"].add(sess.username)
+        g["snapshot"] = tuple(g["members"])
+        invalidate_group_lists(g["snapshot"])
+        await notify_group_members(g["snapshot"], {"type": "group_event", "groupId": gid, "action": "join", "by": sess.username, "timestamp": now_iso()})
+
+
+async def _handle_leave_group(sess: Session, data):
+    gid = data.get("groupId")
+    g = groups.get(gid)
+    if g and sess.username in g["members"]:
+        g["members"].discard(sess.username)
+        g["snapshot"] = tuple(g["members"])
+        invalidate_group_lists(g["snapshot"])
+        _group_list_frames.pop(sess.username, None)
+        await notify_group_members(g["snapshot"], {"type": "group_event", "groupId": gid, "action": "leave", "by": sess.username, "timestamp": now_iso()})
+
+
+async def _handle_group_message(sess: Session, data):
+    # { type, groupId, text?|image? }
+    username = sess.username
+    gid = data.get("groupId")
+    text = data.get("text")
+    image = data.get("image")
+    g = groups.get(gid)
+    if g and (text or image):
+        relay = {
+            "type": "group_relay",
+            "groupId": gid,
+            "from": username,
+            "payload": ({"text": text} if text else {"image": image}),
+            "timestamp": now_iso(),
+        }
+        frame = frame_encoder(relay)  # one encode per wire format for the whole group
+        targets = []
+        for member in g["snapshot"]:
+            if member == username:
+                continue
+            sess_m = sessions.get(member)
+            if sess_m:
+                targets.append(sess_m)
+        results = await asyncio.gather(*(t.ws.send(frame(proto_of(t.ws))) for t in targets), return_exceptions=True)
+        for target, res in zip(targets, results):
+            if isinstance(res, BaseException):
+                log.warning(f"Failed to relay group message to {target.username}: {res}")
+                await cleanup_user(target.username, target)
+
+
+HANDLERS = {
+    "message": _handle_message,
+    "handshake": _handle_handshake,
+    "create_group": _handle_create_group,
+    "join_group": _handle_join_group,
+    "leave_group": _handle_leave_group,
+    "group_message": _handle_group_message,
+}
 
 
 # ----------------------
@@ -107,14 +492,17 @@ async def cleanup_user(username):
 
 async def handler(websocket, path):
     # CORS is handled by the handle_cors_request function
-    query = parse_qs(urlparse(path).query)
-    username = query.get("username", [None])[0]
+    username = None
+    for kv in path.partition("?")[2].split("&"):
+        if kv.startswith("username="):
+            username = unquote_plus(kv[9:])  # same decoding parse_qs applied
+            break
 
     if not username:
         await websocket.close(4000, "Missing username")
         return
 
-    if username in clients:
+    if username in sessions:
         await safe_send(websocket, {
             "type": "error",
             "message": f"Username {username} is already connected"
@@ -125,18 +513,16 @@ async def handler(websocket, path):
             pass
         return
 
-    clients[username] = websocket
-    print(f"[CONNECT] {username} connected from {websocket.remote_address}")
+    sess = sessions[username] = Session(username, websocket)
+    log.info(f"[CONNECT] {username} connected from {websocket.remote_address}")
 
-    await broadcast_user_list()
+    schedule_user_list_broadcast()
 
     # Create backend ChatClient (will fix later)
-    chat_client = ChatClient(username)
-    chat_clients[username] = chat_client
-    await chat_client.connect()
+    sess.chat = ChatClient(username)
+    await sess.chat.connect()
 
     # Bridge backend events to the browser websocket
-    pending_outbound: dict[str, list[str]] = {}
 
     async def forward_backend_event(evt):
         # Normalize to include timestamp for the UI
@@ -144,228 +530,88 @@ async def handler(websocket, path):
             if "type" not in evt:
                 evt["type"] = "message"
             if "timestamp" not in evt:
-                evt["timestamp"] = datetime.datetime.utcnow().isoformat()
+                evt["timestamp"] = now_iso()
             # On handshake success, flush any queued outbound messages
             if evt["type"] == "handshake_success":
                 peer = evt.get("peer")
-                if peer and peer in pending_outbound and pending_outbound[peer]:
-                    msgs = pending_outbound.pop(peer)
-                    for text in msgs:
-                        try:
-                            await chat_client.send_message(peer, text)
-                            print(f"[FLUSH] {username} -> {peer}: (encrypted)")
-                        except Exception as e:
-                            print(f"[ERROR] flush send failed: {e}")
+                if peer and sess.pending.get(peer):
+                    msgs = sess.pending.pop(peer)
+                    try:
+                        await sess.chat.send_many(peer, msgs)
+                        log.info(f"[FLUSH] {username} -> {peer}: {len(msgs)} (encrypted)")
+                    except Exception as e:
+                        log.error(f"flush send failed: {e}")
             await safe_send(websocket, evt, username_for_cleanup=username)
-    chat_client.on_message = forward_backend_event
+    sess.chat.on_message = forward_backend_event
 
     ok = await safe_send(websocket, {
         "type": "welcome",
         "message": f"Welcome {username}",
-        "users": [u for u in clients if u != username] + [AI_BOT_NAME]
+        "users": [u for u in sessions if u != username] + [AI_BOT_NAME]
     }, username_for_cleanup=username)
     if not ok:
         return
 
     # Auto-complete handshake with AI bot for convenience
-    await safe_send(websocket, {"type": "handshake_success", "peer": AI_BOT_NAME, "timestamp": datetime.datetime.utcnow().isoformat()})
+    await safe_send(websocket, {"type": "handshake_success", "peer": AI_BOT_NAME, "timestamp": now_iso()})
     # Send current groups for this user
     await send_group_list(username)
 
+    proto = proto_of(websocket)
+    decode = DECODERS[proto]
     try:
         async for message in websocket:
             try:
-                data = json.loads(message)
-                msg_type = data.get("type")
-
-                if msg_type == "message":
-                    peer = data.get("to")
-                    text = data.get("text")
-                    image = data.get("image")
-                    # Handle messages to AI bot locally (no encryption)
-                    if peer == AI_BOT_NAME and (text or image):
-                        reply_text = None
-                        if text:
-                            # Compose prompt
-                            payload = {
-                                "model": OPENROUTER_MODEL,
-                                "messages": [
-                                    {"role": "system", "content": "You are a helpful, concise assistant in a messaging app."},
-                                    {"role": "user", "content": text}
-                                ]
-                            }
-                            headers = {
-                                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                                "Content-Type": "application/json",
-                                "HTTP-Referer": "http://localhost:5173",
-                                "X-Title": "Secure Chat App"
-                            }
-                            try:
-                                res = requests.post(OPENROUTER_URL, headers=headers, json=payload, timeout=30)
-                                data_out = res.json()
-                                reply_text = (data_out.get("choices", [{}])[0].get("message", {}).get("content")
-                                              or "(No response)")
-                            except Exception as e:
-                                print(f"[AI] Error: {e}")
-                                reply_text = "⚠️ AI service unavailable, please try again later."
-
-                        # Send bot reply back to this user as a normal relay
-                        await safe_send(websocket, {
-                            "type": "relay",
-                            "from": AI_BOT_NAME,
-                            "payload": {"text": reply_text or "(image received)"},
-                            "timestamp": datetime.datetime.utcnow().isoformat(),
-                        }, username_for_cleanup=username)
-                        continue
-                    if peer and text:
-                        try:
-                            if hasattr(chat_client, "has_session") and chat_client.has_session(peer):
-                                await chat_client.send_message(peer, text)
-                                print(f"[MSG] {username} -> {peer}: (encrypted)")
-                            else:
-                                # queue and initiate handshake
-                                pending_outbound.setdefault(peer, []).append(text)
-                                await chat_client.initiate_handshake(peer)
-                                await safe_send(websocket, {"type": "system", "text": f"Initiating handshake with {peer}..."})
-                        except Exception as e:
-                            print(f"[ERROR] send_message failed: {e}")
-                    elif peer and image:
-                        # For now, relay images in plaintext to peer via gateway
-                        if peer in clients:
-                            sent = await safe_send(clients[peer], {
-                                "type": "relay",
-                                "from": username,
-                                "payload": {"image": image}
-                            }, username_for_cleanup=peer)
-                            if sent:
-                                print(f"[IMG] {username} -> {peer}: (relayed image)")
-                    else:
-                        await safe_send(websocket, {"type": "error", "message": "Missing peer, text or image"}, username_for_cleanup=username)
-
-                elif msg_type == "handshake":
-                    peer = data.get("peer")
-                    if peer == AI_BOT_NAME:
-                        # Instantly succeed handshakes to AI bot
-                        await safe_send(websocket, {"type": "handshake_success", "peer": AI_BOT_NAME, "timestamp": datetime.datetime.utcnow().isoformat()})
-                    elif peer in clients:
-                        await chat_client.initiate_handshake(peer)
-                    else:
-                        await safe_send(websocket, {
-                            "type": "error",
-                            "message": f"{peer} is offline"
-                        }, username_for_cleanup=username)
-
-                elif msg_type == "create_group":
-                    # { type, groupId?, name, members: [user...] }
-                    name = (data.get("name") or "Group").strip() or "Group"
-                    group_id = data.get("groupId") or f"grp:{username}:{int(datetime.datetime.utcnow().timestamp())}"
-                    member_list = set(filter(None, [username] + list(data.get("members") or [])))
-                    # Validate all members exist (must be connected users or AI bot)
-                    invalid = [m for m in member_list if m != AI_BOT_NAME and m not in clients]
-                    if invalid:
-                        await safe_send(websocket, {
-                            "type": "error",
-                            "message": f"Invalid users in group: {', '.join(invalid)}"
-                        }, username_for_cleanup=username)
-                        break
-                    groups[group_id] = {"name": name, "members": set(member_list)}
-                    # notify members
-                    for member in list(member_list):
-                        await send_group_list(member)
-                        ws_m = clients.get(member)
-                        if ws_m:
-                            await safe_send(ws_m, {"type": "group_added", "group": {"id": group_id, "name": name, "members": list(member_list)}})
-
-                elif msg_type == "join_group":
-                    gid = data.get("groupId")
-                    if gid in groups:
-                        groups[gid]["members"].add(username)
-                        for member in list(groups[gid]["members"]):
-                            await send_group_list(member)
-                            ws_m = clients.get(member)
-                            if ws_m:
-                                await safe_send(ws_m, {"type": "group_event", "groupId": gid, "action": "join", "by": username, "timestamp": datetime.datetime.utcnow().isoformat()})
-
-                elif msg_type == "leave_group":
-                    gid = data.get("groupId")
-                    if gid in groups and username in groups[gid]["members"]:
-                        groups[gid]["members"].discard(username)
-                        for member in list(groups[gid]["members"]):
-                            await send_group_list(member)
-                            ws_m = clients.get(member)
-                            if ws_m:
-                                await safe_send(ws_m, {"type": "group_event", "groupId": gid, "action": "leave", "by": username, "timestamp": datetime.datetime.utcnow().isoformat()})
-
-                elif msg_type == "group_message":
-                    # { type, groupId, text?|image? }
-                    gid = data.get("groupId")
-                    text = data.get("text")
-                    image = data.get("image")
-                    if gid in groups and (text or image):
-                        recipients = groups[gid]["members"] - {username}
-                        for member in recipients:
-                            ws_m = clients.get(member)
-                            if ws_m:
-                                await safe_send(ws_m, {
-                                    "type": "group_relay",
-                                    "groupId": gid,
-                                    "from": username,
-                                    "payload": ({"text": text} if text else {"image": image}),
-                                    "timestamp": datetime.datetime.utcnow().isoformat(),
-                                }, username_for_cleanup=member)
-
-            except json.JSONDecodeError:
-                print(f"[WARN] Invalid JSON from {username}")
+                data = decode(message)
+                h = HANDLERS.get(data.get("type"))
+                if h:
+                    await h(sess, data)
+            except DECODE_ERRORS:
+                log.warning(f"Invalid {proto} frame from {username}")
             except Exception as e:
-                print(f"[ERROR] {e}")
-                traceback.print_exc()
+                log.exception(e)
 
     except ConnectionClosed:
-        print(f"[DISCONNECT] {username}")
+        log.info(f"[DISCONNECT] {username}")
 
     finally:
-        await cleanup_user(username)
+        await cleanup_user(username, sess)
 
 
 # ----------------------
 # CORS Handler (websockets 12.x)
 # ----------------------
 
+# Built once at import; AbortHandshake copies the headers it's given, so these
+# are never mutated by a response.
+_PREFLIGHT_HEADERS = (
+    ("Access-Control-Allow-Methods", "GET, POST, OPTIONS"),
+    ("Access-Control-Allow-Headers", "Content-Type, Authorization"),
+    ("Access-Control-Allow-Credentials", "true"),
+    ("Access-Control-Max-Age", "3600"),
+)
+_NF_HEADERS = Headers([("Content-Type", "text/plain")])
+
+
 def handle_cors_request(path, request_headers):
-    # Debug: Print incoming request details
-    print("\n=== New Request ===")
-    print(f"Path: {path}")
-    print("Headers:")
-    for k, v in request_headers.items():
-        print(f"  {k}: {v}")
-    
-    # For WebSocket handshake, we only need to check these headers
-    upgrade = request_headers.get("upgrade", "").lower()
-    connection = request_headers.get("connection", "").lower()
-    
-    print(f"\nUpgrade: {upgrade}")
-    print(f"Connection: {connection}")
-    
-    # Accept WebSocket connection if upgrade header is 'websocket' and connection is 'upgrade'
-    if upgrade == "websocket" and "upgrade" in connection:
-        print("✓ Accepting WebSocket connection")
-        return None  # Return None to accept the WebSocket connection
-    
-    # For OPTIONS (preflight) requests
-    if request_headers.get("method") == "OPTIONS" or request_headers.get(":method") == "OPTIONS":
-        print("Handling OPTIONS request")
-        headers = [
-            ("Access-Control-Allow-Origin", request_headers.get("origin", "*")),
-            ("Access-Control-Allow-Methods", "GET, POST, OPTIONS"),
-            ("Access-Control-Allow-Headers", "Content-Type, Authorization"),
-            ("Access-Control-Allow-Credentials", "true"),
-            ("Access-Control-Max-Age", "3600"),
-        ]
-        return 200, Headers(headers), b""
-    
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"=== New Request === Path: {path}")
+        for k, v in request_headers.items():
+            log.debug(f"  {k}: {v}")
+
+    # Accept WebSocket upgrades; the handshake itself validates Connection etc.
+    upgrade = request_headers.get("upgrade", "")
+    if upgrade and upgrade.lower() == "websocket":
+        return None
+
+    # For OPTIONS (preflight) requests; the allowed origin echoes the caller's
+    method = request_headers.get(":method") or request_headers.get("method")
+    if method == "OPTIONS":
+        return 200, Headers([("Access-Control-Allow-Origin", request_headers.get("origin", "*")), *_PREFLIGHT_HEADERS]), b""
+
     # For all other requests, return 404
-    print("✗ Rejecting request (not a WebSocket upgrade)")
-    return 404, Headers([("Content-Type", "text/plain")]), b"Not Found"
+    log.debug("✗ Rejecting request (not a WebSocket upgrade)")
+    return 404, _NF_HEADERS, b"Not Found"
 
 
 # ----------------------
@@ -373,22 +619,40 @@ def handle_cors_request(path, request_headers):
 # ----------------------
 
 async def main():
-    print("🚀 Starting WebSocket Gateway...")
+    global AIO_SESSION
+    log.info("🚀 Starting WebSocket Gateway...")
+    AIO_SESSION = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=30),
+        connector=aiohttp.TCPConnector(limit=64, keepalive_timeout=60),
+    )
     server = await websockets.serve(
         handler,
         "0.0.0.0",
         8765,
         process_request=handle_cors_request,
+        subprotocols=SUBPROTOCOLS,
         ping_interval=20,
         ping_timeout=60,
         max_size=10 * 1024 * 1024
     )
-    print("🌐 Running on ws://0.0.0.0:8765")
-    await server.wait_closed()
+    log.info("🌐 Running on ws://0.0.0.0:8765")
+    writer = asyncio.create_task(log_writer())
+    try:
+        await server.wait_closed()
+    finally:
+        writer.cancel()
+        leftover = _drain_log_queue()
+        if leftover:
+            _append_blob(leftover)
+        await AIO_SESSION.close()
 
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.install()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\n🛑 Server stopped")
\ No newline at end of file
+        log.info("🛑 Server stopped")
+    finally:
+        _log_listener.stop()
\ No newline at end of file